@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/23 16:05
+# @Author  : pikadoramon
+# @File    : bench_extractor.py
+# @Software: PyCharm
+"""
+Compare the compiled RowExtractor with the per-field traverse_obj rule loop,
+yt_dlp's traverse_obj is used as the baseline when it is installed
+
+    python -m bench.bench_extractor
+"""
+import timeit
+
+try:
+    from yt_dlp.utils import traverse_obj
+except ImportError:
+    from workers.api.extractor import traverse_obj
+
+from workers.api.tiktok_user import ITEM_RULE, VIDEO_RULE, USER_RULE, row_extractor
+
+ITEM = {
+    "id": "7395011111111111111",
+    "createTime": 1721800000,
+    "desc": "sample",
+    "author": {"id": "6811111111111111111", "uniqueId": "sample", "nickname": "Sample",
+               "avatarLarger": "https://p16-sign.tiktokcdn.com/a.jpeg", "signature": "hello",
+               "secUid": "MS4wLjABAAAA"},
+    "stats": {"diggCount": 10, "collectCount": 2, "commentCount": 3, "playCount": 100, "shareCount": 1},
+    "video": {
+        "cover": "https://p16-sign.tiktokcdn.com/c.jpeg",
+        "duration": 15,
+        "bitrateInfo": [{"PlayAddr": {"UrlList": ["https://v16.tiktokcdn.com/a.mp4", "https://www.tiktok.com/a.mp4"],
+                                      "Width": 576, "Height": 1024}}],
+    },
+}
+
+
+def rule_loop(item):
+    item_info = dict()
+    for rule in (ITEM_RULE, VIDEO_RULE, USER_RULE):
+        for e in rule:
+            if not isinstance(rule[e], tuple):
+                continue
+            value = traverse_obj(item, rule[e])
+            if value is None:
+                raise ValueError(f"null value {e} {rule[e]}")
+            item_info[e] = value
+    return item_info
+
+
+def main(number=20000):
+    extract = row_extractor()
+    assert rule_loop(ITEM) == extract(ITEM)
+    baseline = timeit.timeit(lambda: rule_loop(ITEM), number=number)
+    compiled = timeit.timeit(lambda: extract(ITEM), number=number)
+    print(f"traverse_obj  {baseline / number * 1e6:8.2f} us/item")
+    print(f"compiled      {compiled / number * 1e6:8.2f} us/item  x{baseline / compiled:.1f}")
+
+
+if __name__ == "__main__":
+    main()
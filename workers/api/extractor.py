@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/23 15:20
+# @Author  : pikadoramon
+# @File    : extractor.py
+# @Software: PyCharm
+from functools import lru_cache
+
+
+def compile_path(path):
+    """
+    Compile a traverse_obj style path tuple into a plain getter,
+    ("video", "bitrateInfo", 0) becomes `lambda obj: obj["video"]["bitrateInfo"][0]` returning None when missing
+    :param path:
+    :return:
+    """
+    source = "".join("[{!r}]".format(key) for key in path)
+    namespace = {}
+    exec(
+        "def getter(obj):\n"
+        "    try:\n"
+        "        return obj{}\n"
+        "    except (LookupError, TypeError):\n"
+        "        return None\n".format(source),
+        namespace
+    )
+    return namespace["getter"]
+
+
+_cached_path = lru_cache(maxsize=256)(compile_path)
+
+
+def traverse_obj(obj, path, default=None):
+    """
+    Lightweight replacement of yt_dlp's traverse_obj for the plain paths used here:
+    keys and (negative) indices only, `default` when any step is missing or the value is None
+    :param obj:
+    :param path: tuple of keys/indices or a single key
+    :param default:
+    :return:
+    """
+    if not isinstance(path, tuple):
+        path = (path,)
+    value = _cached_path(path)(obj)
+    return default if value is None else value
+
+
+class RowExtractor:
+    """
+    Flatten item_list entries with getters compiled once from rule dicts ({field: path tuple}).
+    Fields under `author` are constant for a user, they are extracted once per author id.
+    Use one instance per user.
+    """
+
+    def __init__(self, *rules, constant_prefix="author"):
+        self.paths = {}
+        for rule in rules:
+            for key, path in rule.items():
+                if isinstance(path, tuple):
+                    self.paths[key] = path
+        self._fields = [
+            (key, None if path[0] == constant_prefix else compile_path(path))
+            for key, path in self.paths.items()
+        ]
+        self._constant_fields = [
+            (key, compile_path(path)) for key, path in self.paths.items() if path[0] == constant_prefix
+        ]
+        self._constant_id = compile_path((constant_prefix, "id"))
+        self._constant_key = None
+        self._constant = {}
+
+    def __call__(self, item):
+        constant_key = self._constant_id(item)
+        if constant_key is None or constant_key != self._constant_key:
+            self._constant = {key: getter(item) for key, getter in self._constant_fields}
+            self._constant_key = constant_key
+
+        row = {}
+        for key, getter in self._fields:
+            value = self._constant[key] if getter is None else getter(item)
+            if value is None:
+                raise ValueError(f"null value {key} {self.paths[key]}")
+            row[key] = value
+        return row
@@ -9,11 +9,98 @@ import json
 import re
 import time
 import traceback
-from urllib.parse import urlencode
+from collections import deque
+from urllib.parse import urlencode, urljoin, urlparse
 
 import aiohttp
-from yt_dlp.utils import traverse_obj
-from workers.exceptions.inject_exception import EmptyResponseError, EmptyFieldError
+from loguru import logger
+from workers.api.extractor import RowExtractor, traverse_obj
+from workers.prefetch import read_ahead
+from workers.exceptions.inject_exception import EmptyResponseError, EmptyFieldError, RequestTimeoutError
+
+
+SHARE_HEADERS = {
+    "Accept-Encoding": "gzip",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.132 Safari/537.36"
+}
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+
+class ShareLinkResolver:
+    """
+    Resolve vm/vt short links to www.tiktok.com urls over one pooled session.
+    Redirect chains are followed hop by hop up to `max_redirects`, results are cached per url.
+
+        async with ShareLinkResolver(concurrency=50) as resolver:
+            results = await resolver.resolve_many(urls)
+    """
+
+    def __init__(self, concurrency=20, proxies=None, headers=None, timeout=5, max_redirects=5):
+        self.concurrency = concurrency
+        self.proxies = proxies
+        self.headers = headers or SHARE_HEADERS
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.cache = {}
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300),
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._client.close()
+
+    async def resolve(self, url):
+        """
+        :param url:
+        :return: {"status": 1, "msg": "", "data": {"url": ...}} on success
+        """
+        if url not in self.cache:
+            # concurrent callers of the same url share one lookup
+            self.cache[url] = asyncio.ensure_future(self._resolve(url))
+        try:
+            return await asyncio.shield(self.cache[url])
+        except Exception as e:
+            self.cache.pop(url, None)
+            return {"status": -1, "msg": str(e), "data": None}
+
+    async def resolve_many(self, urls):
+        """
+        :param urls:
+        :return: dict url -> result
+        """
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.resolve(url) for url in urls))
+        return dict(zip(urls, results))
+
+    async def _resolve(self, url):
+        status = 0
+        msg = ""
+        async with self._semaphore:
+            for _ in range(self.max_redirects + 1):
+                if url.startswith("https://www.tiktok.com/"):
+                    if urlparse(url).path.strip("/") in ("", "notfound"):
+                        # dead links land on the home page
+                        return {"status": status, "msg": "page not found", "data": None}
+                    return {"status": 1, "msg": "", "data": {"url": url.split("?")[0]}}
+                async with self._client.get(url, proxy=self.proxies, allow_redirects=False) as response:
+                    if response.status in REDIRECT_STATUS and "Location" in response.headers:
+                        status = response.status
+                        url = urljoin(url, response.headers["Location"])
+                        continue
+                    status = -1
+                    msg = await response.text()
+                    break
+            else:
+                msg = "too many redirects"
+        return {"status": status, "msg": msg, "data": None}
 
 
 async def share_to_real_async(url, proxies=None, headers=None):
@@ -24,160 +111,339 @@ async def share_to_real_async(url, proxies=None, headers=None):
     :param headers:
     :return:
     """
-    status = 0
-    msg = ""
-    user_info = null
+    async with ShareLinkResolver(concurrency=1, proxies=proxies, headers=headers) as resolver:
+        return await resolver.resolve(url)
 
-    if url.startswith("https://www.tiktok.com/"):
-        user_info = {
-            'url': url.split("?")[0]
-        }
-        status = 1
-        msg = ""
-    else:
-        if not headers:
-            headers = {
-                "Accept-Encoding": "gzip",
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.132 Safari/537.36"
-            }
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(url, proxy=proxies, timeout=5, allow_redirects=False) as response:
-                if response.status == 301:
-                    real_url = response.headers["Location"].split("?")[0]
-                    if real_url.startswith("https://www.tiktok.com/"):
-                        user_info = {
-                            'url': real_url
-                        }
-                        status = 1
-                        msg = ""
-                    elif real_url.startswith("https://m.tiktok.com/") or real_url.startswith("https://t.tiktok.com/"):
-                        async with session.get(real_url, proxy=proxies, timeout=5, allow_redirects=False) as response:
-                            real_url = response.headers["Location"].split("?")[0]
-                            if response.status == 301 and real_url.startswith("https://www.tiktok.com/"):
-                                real_url = response.headers["Location"].split("?")[0]
-                                user_info = {
-                                    'url': real_url
-                                }
-                                status = 1
-                                msg = ""
-                elif response.status == 302:
-                    status = response.status
-                    msg = "page not found"
-                else:
-                    status = -1
-                    msg = await response.text()
+DEFAULT_PARAMS = dict(
+    WebIdLastTime='',
+    aid='1988',
+    app_language='en',
+    app_name='tiktok_web',
+    browser_language='en',
+    browser_name='Mozilla',
+    browser_online='true',
+    browser_platform='Win32',
+    browser_version='',
+    channel='tiktok_web',
+    cookie_enabled='true',
+    count='35',
+    coverFormat='2',
+    cursor='0',
+    data_collection_enabled='true',
+    device_id='',
+    device_platform='web_pc',
+    focus_state='true',
+    from_page='user',
+    history_len='3',
+    is_fullscreen='false',
+    is_page_visible='true',
+    language='en',
+    needPinnedItemIds='true',
+    odinId='',
+    os='windows',
+    post_item_list_request_type='0',
+    priority_region='',
+    referer='',
+    region='',
+    screen_height='1152',
+    screen_width='2048',
+    secUid='',
+    tz_name='Asia/Shanghai',
+    user_is_login='false',
+)
+FINGERPRINT_RULE = dict(
+    WebIdLastTime=r'"webIdCreatedTime":"(?P<WebIdLastTime>\d+)"',
+    browser_version=r'"userAgent":"(?P<browser_version>.+?)(?=",")',
+    device_id=r'"wid":"(?P<device_id>\d+)"',
+    odinId=r'"odinId":"(?P<odinId>\d+)"',
+    region=r'"region":"(?P<region>\w+)"',
+    secUid=r'"secUid":"(?P<secUid>.+?)(?=",")',
+)
+ITEM_LIST_API = "https://www.tiktok.com/api/post/item_list/?"
+USER_ID_PATTERN = re.compile(r'"userInfo":\{"user":\{"id":"(\d+)"')
+# fields that belong to the browser session rather than to a user
+DEVICE_FIELDS = ("WebIdLastTime", "browser_version", "device_id", "odinId", "region")
+# one alternation over all fingerprint fields, the document is scanned once.
+# trailing delimiters are lookaheads so a match never consumes the anchor of the next field
+FINGERPRINT_PATTERN = re.compile("|".join(FINGERPRINT_RULE.values()))
+
 
-    return {
-        "status": status,
-        "msg": msg,
-        "data": user_info
-    }
+def normalize_username(value):
+    """
+    Bare account name of `name`, `@name` or a profile url such as `https://www.tiktok.com/@name?lang=en`
+    :param value:
+    :return:
+    """
+    return value.strip().split("?")[0].rstrip("/").split("@")[-1].split("/")[0]
+
+
+def extract_fingerprint(data):
+    """
+    Scan the page html once for the fingerprint fields
+    :param data: page html
+    :return: (params, missing), params is DEFAULT_PARAMS filled with every field found
+    """
+    params = dict(DEFAULT_PARAMS)
+    missing = set(FINGERPRINT_RULE)
+    for match in FINGERPRINT_PATTERN.finditer(data):
+        k = match.lastgroup
+        if k not in missing:
+            continue
+        missing.discard(k)
+        value = match.group(k).encode('utf-8').decode('unicode-escape')
+        if k == "browser_version":
+            value = value.replace("Mozilla/", "")
+        params[k] = value
+        if not missing:
+            break
+    return params, missing
+
+
+def cache_fingerprint(session, params):
+    """
+    Keep the device level fields on the session they were harvested from
+    :param session: TikTokPlaywrightSession
+    :param params:
+    :return:
+    """
+    fingerprint = {k: params[k] for k in DEVICE_FIELDS}
+    if all(fingerprint.values()):
+        session.fingerprint = fingerprint
 
 
 def serialize_fields(data):
-    re_fields = [
-        "WebIdLastTime",
-        "browser_version",
-        "device_id",
-        "odinId",
-        "region",
-        "secUid"
-    ]
-    fields_rule = dict(
-        WebIdLastTime='"webIdCreatedTime":"(\d+)"',
-        aid='1988',
-        app_language='en',
-        app_name='tiktok_web',
-        browser_language='en',
-        browser_name='Mozilla',
-        browser_online='true',
-        browser_platform='Win32',
-        browser_version='"userAgent":"(.+?)","',
-        channel='tiktok_web',
-        cookie_enabled='true',
-        count='35',
-        coverFormat='2',
-        cursor='0',
-        data_collection_enabled='true',
-        device_id='"wid":"(\d+)"',
-        device_platform='web_pc',
-        focus_state='true',
-        from_page='user',
-        history_len='3',
-        is_fullscreen='false',
-        is_page_visible='true',
-        language='en',
-        needPinnedItemIds='true',
-        odinId='"odinId":"(\d+)"',
-        os='windows',
-        post_item_list_request_type='0',
-        priority_region='',
-        referer='',
-        region='"region":"(\w+)"',
-        screen_height='1152',
-        screen_width='2048',
-        secUid='"secUid":"(.+?)","',
-        tz_name='Asia/Shanghai',
-        user_is_login='false',
-    )
-    empty_fields = set()
-    for k in re_fields:
-        value = re.search(fields_rule[k], data)
-        if value:
-            fields_rule[k] = value.group(1).encode('utf-8').decode('unicode-escape')
-            if k == "browser_version":
-                fields_rule[k] = fields_rule[k].replace("Mozilla/", "")
-        else:
-            empty_fields.add(k)
+    params, empty_fields = extract_fingerprint(data)
     if "secUid" in empty_fields and len(empty_fields) <= 1:
-        return fields_rule
+        return params
     if len(empty_fields) == 0:
-        return fields_rule
+        return params
     raise EmptyFieldError(f"empty {empty_fields} fields")
 
 
+VIDEO_RULE = {
+    "id": ("id",),
+    "picture_url": ("video", "cover"),
+    "video_url": ("video", "bitrateInfo", 0, "PlayAddr", "UrlList", -1),
+    "width": ("video", "bitrateInfo", 0, "PlayAddr", "Width"),
+    "height": ("video", "bitrateInfo", 0, "PlayAddr", "Height"),
+    "duration_second": ("video", "duration"),
+}
+ITEM_RULE = {
+    "user_id": ("author", "id"),
+    "username": ("author", "uniqueId"),
+    "item_id": ("id",),
+    "videos": None,
+    "publish_time": ("createTime",),
+    "description": ("desc",),
+    "like_count": ("stats", "diggCount"),
+    "download_count": ("stats", "collectCount"),
+    "comment_count": ("stats", "commentCount"),
+    "play_count": ("stats", "playCount"),
+    "share_count": ("stats", "shareCount")
+}
+USER_RULE = {
+    "user_id": ("author", "id"),
+    "username": ("author", "uniqueId"),
+    "nickname": ("author", "nickname"),
+    "avatar_url": ("author", "avatarLarger"),
+    "signature": ("author", "signature")
+}
+
+
+# item paths videos() and the row extractor read, used to project item_list pages inside the page
+ITEM_PROJECTION = list(dict.fromkeys(
+    [rule[e] for rule in (ITEM_RULE, VIDEO_RULE, USER_RULE) for e in rule if isinstance(rule[e], tuple)]
+    + [("createTime",), ("isPinnedItem",), ("author", "secUid")]
+))
+
+
+def row_extractor():
+    """
+    Compiled extractor for export rows, create one per user
+    :return:
+    """
+    return RowExtractor(ITEM_RULE, VIDEO_RULE, USER_RULE)
+
+
+def is_page_error(e):
+    """
+    Whether an exception means the session page itself is unhealthy
+    :param e:
+    :return:
+    """
+    return isinstance(e, RequestTimeoutError) or str(e).find("NS_ERROR_PROXY_AUTHENTICATION_FAILED") > -1
+
+
+def is_challenged(response):
+    """
+    Whether an item_list response is unusable: empty, a "Please wait..." challenge page,
+    a non zero statusCode or no itemList
+    :param response:
+    :return:
+    """
+    if not response or response.status_code != 200:
+        return True
+    try:
+        payload = response.json()
+    except ValueError:
+        return True
+    return not isinstance(payload, dict) or payload.get("statusCode", 0) != 0 or payload.get("itemList") is None
+
+
 class TikTokUser:
+    parent = None
+    logger = logger
 
-    def __init__(self, username=None, sec_uid=None):
-        self.username = username
+    def __init__(self, username=None, sec_uid=None, parent=None, logger=None, resolver=None):
+        self.username = normalize_username(username) if username else username
         self.sec_uid = sec_uid
         self.params = None
+        self.resolver = resolver
+        if parent is not None:
+            self.parent = parent
+        if logger is not None:
+            self.logger = logger
 
     def set_username(self, username=None, sec_uid=None):
-        self.username = username
+        self.username = normalize_username(username) if username else username
         self.sec_uid = sec_uid
         self.params = None
 
     async def prepare_user_request(self):
         if self.sec_uid:
-            url = "https://www.tiktok.com/foryou"
-            response = await self.parent.make_inject_request(url)
-            if not response:
-                raise EmptyResponseError(f"{url} empty response body")
-            params = serialize_fields(response.text)
+            params = await self.session_params()
             params["secUid"] = self.sec_uid
             self.params = params
             return
 
+        if self.username and self.resolver is not None:
+            resolved = self.resolver.get(self.username)
+            if resolved:
+                self.logger.info(f"{self} secUid resolved from cache")
+                params = await self.session_params()
+                params["secUid"] = resolved["sec_uid"]
+                self.params = params
+                return
+
         if self.username:
             url = "https://www.tiktok.com/@" + self.username.split("@")[-1]
-            response = await self.parent.make_inject_request(url)
-            if not response:
-                raise EmptyResponseError(f"{url} empty response body")
-            if response.text.find("Please wait...") > 0:
-                self.logger.warning(f"{self} xhr request failed web redirect {url}")
-                await self.parent.execute_js_script(None, f"location.href = \"{url}\"")
-            params = serialize_fields(response.text)
-            self.params = params
-            i, session = self.parent.get_session()
-            await session.page.goto(url)
+            async with self.parent.acquire_session() as session:
+                response = await self.parent.make_inject_request(url, session=session)
+                if not response:
+                    raise EmptyResponseError(f"{url} empty response body")
+                if response.text.find("Please wait...") > 0:
+                    self.logger.warning(f"{self} xhr request failed web redirect {url}")
+                    await self.parent.goto(session, url)
+                params = serialize_fields(response.text)
+                cache_fingerprint(session, params)
+                self.params = params
+                if self.resolver is not None and params["secUid"].startswith("M"):
+                    user_id = USER_ID_PATTERN.search(response.text)
+                    self.resolver.put(self.username, params["secUid"], user_id.group(1) if user_id else None)
+                await self.parent.goto(session, url)
 
             return
 
         raise ValueError("empty user")
 
-    async def videos(self, limit, cursor='0', retry=3, sleep_after=2):
+    async def session_params(self):
+        """
+        Request params of a session, the device fields are cached on the session until it expires
+        so only users given by username need a page fetch
+        :return:
+        """
+        async with self.parent.acquire_session() as session:
+            return dict(DEFAULT_PARAMS, **await self.session_fingerprint(session))
+
+    async def session_fingerprint(self, session):
+        """
+        Device fields of an acquired session, fetched from its own page when not cached yet
+        :param session: TikTokPlaywrightSession
+        :return:
+        """
+        if session.fingerprint is not None and int(time.time()) < session.expired_at:
+            return session.fingerprint
+        url = "https://www.tiktok.com/foryou"
+        response = await self.parent.make_inject_request(url, session=session)
+        if not response:
+            raise EmptyResponseError(f"{url} empty response body")
+        params = serialize_fields(response.text)
+        cache_fingerprint(session, params)
+        return {k: params[k] for k in DEVICE_FIELDS}
+
+    async def fetch_page(self, params, fast_path=False, projection=None):
+        """
+        Fetch one item_list page. The device fields are taken from the session serving the request
+        so they always match its cookies. With `fast_path` try a direct http request first and
+        fall back to the in-page XHR when the response is empty or challenged
+        :param params: user request params
+        :param fast_path:
+        :param projection: item paths the page should project the JSON to, see make_inject_request
+        :return:
+        """
+        # one session serves the fingerprint, the http try, the page fallback and the cookie sync
+        async with self.parent.acquire_session() as session:
+            params = dict(params, **await self.session_fingerprint(session))
+            url = ITEM_LIST_API + urlencode(params)
+            if not fast_path:
+                return await self.parent.make_inject_request(url=url, session=session, projection=projection,
+                                                             challenged=is_challenged)
+            try:
+                response = await self.parent.make_http_request(url, session=session)
+                if not is_challenged(response):
+                    return response
+                self.logger.warning(f"{self} fast path challenged, fall back to page request")
+            except Exception as e:
+                self.logger.warning(f"{self} fast path exc: {e}, fall back to page request")
+            response = await self.parent.make_inject_request(url=url, session=session, projection=projection,
+                                                             challenged=is_challenged)
+            if response:
+                # the page may have refreshed its cookies while passing the challenge
+                await self.parent.sync_http_cookies(session)
+            return response
+
+    @property
+    def user_key(self):
+        if self.sec_uid:
+            return self.sec_uid
+        if self.username:
+            return self.username.split("@")[-1]
+        return None
+
+    async def videos(self, limit, cursor='0', retry=3, sleep_after=None, fast_path=False, checkpoint=None,
+                     since=None, known_ids=None, project=False, prefetch=0, deep=False,
+                     cursor_window=64, progress_every=10, on_commit=None):
+        """
+        Iterate the raw item_list entries of the user
+        :param sleep_after: fixed delay before every page, by default the sessions' adaptive pacers set the pace
+        :param checkpoint: optional CheckpointStore, resumes from the saved cursor and skips emitted items
+        :param since: incremental mode, items with createTime <= since are treated as already seen.
+            It always starts at the newest page, a checkpoint then only dedups items and its cursor is left as is
+        :param known_ids: incremental mode, item ids already archived
+        :param project: let the page parse item_list and return only the fields of ITEM_PROJECTION
+        :param prefetch: pages fetched ahead while the consumer works through the current one, 0 disables it
+        :param deep: lift the 500 items cap, a falsy limit then means the whole history
+        :param cursor_window: recent cursors kept for loop detection
+        :param progress_every: log progress and pages/s every n pages
+        :param on_commit: coroutine function awaited before a page is saved to the checkpoint,
+            it should make the items already consumed durable (flush the output, finish their downloads)
+        :return:
+        """
+        incremental = since is not None or known_ids is not None
+        known_ids = {str(e) for e in known_ids or ()}
+        found = 0
+        saved_cursor, done = None, False
+        if checkpoint is not None:
+            saved_cursor, done = checkpoint.get_cursor(self.user_key)
+        if checkpoint is not None and not incremental:
+            if done:
+                self.logger.info(f"{self} already finished in checkpoint")
+                return
+            if saved_cursor:
+                self.logger.info(f"{self} resume from cursor {saved_cursor}")
+                cursor = saved_cursor
+            found = checkpoint.item_count(self.user_key)
 
         c = 0
         while c < retry:
@@ -189,53 +455,141 @@ class TikTokUser:
             except Exception as e:
                 c += 1
                 self.logger.error(f"{self} {c}/{retry} exc: {e}")
-                if str(e).find("Timeout") > -1 or str(e).find("NS_ERROR_PROXY_AUTHENTICATION_FAILED") > -1:
+                if is_page_error(e):
                     self.parent.page_error = True
 
-            await asyncio.sleep(sleep_after)
+            await asyncio.sleep(sleep_after or c)
         if self.params is None:
             raise EmptyFieldError("empty user fingerprint")
         if not self.params["secUid"].startswith("M"):
             raise EmptyFieldError(f"error secUid {self.params}")
 
         self.logger.info("null user parameters: null".format(self, json.dumps(self.params)))
-        limit = min(limit, 500)
-        c = 0
-        found = 0
-        seen_cursors = set([])
+        if not deep:
+            limit = min(limit, 500)
+        elif not limit:
+            limit = float("inf")
+        if found >= limit:
+            return
+        started_at = time.time()
+        page_count = 0
+
+        pages = self.pages(cursor, retry, sleep_after, fast_path, project, cursor_window)
+        if prefetch:
+            pages = read_ahead(pages, prefetch)
+        try:
+            async for payload, last in pages:
+                page_ids = []
+                reached_mark = False
+                new_items = 0
+                page_count += 1
+                emitted = set()
+                if checkpoint is not None:
+                    emitted = checkpoint.known_items(self.user_key, [e.get("id") for e in payload["itemList"]])
+                for item in payload["itemList"]:
+                    if str(item.get("id")) in emitted:
+                        continue
+                    if incremental and self._is_known(item, since, known_ids):
+                        # pinned items are old posts shown on the first page, they do not mark the end
+                        if not item.get("isPinnedItem"):
+                            reached_mark = True
+                        continue
+                    new_items += 1
+                    found += 1
+                    page_ids.append(item.get("id"))
+                    yield item
+                if checkpoint is not None and on_commit is not None:
+                    await on_commit()
+                if checkpoint is not None and incremental:
+                    # new posts only, keep the resume point of a full crawl
+                    checkpoint.save_page(self.user_key, saved_cursor, page_ids, done=done)
+                elif checkpoint is not None:
+                    checkpoint.save_page(self.user_key, payload.get("cursor"), page_ids, done=last)
+                if page_count % progress_every == 0:
+                    elapsed = time.time() - started_at
+                    self.logger.info(f"{self} progress pages={page_count} items={found} "
+                                     f"{page_count / elapsed:.2f} pages/s")
+                if last or found >= limit:
+                    break
+                if incremental and (reached_mark or new_items == 0):
+                    # pages are newest first, nothing after the high-water mark can be new
+                    self.logger.info(f"{self} reached high-water mark, found {found} new items")
+                    break
+        finally:
+            await pages.aclose()
 
-        while found < limit:
+    async def pages(self, cursor='0', retry=3, sleep_after=None, fast_path=False, project=False,
+                    cursor_window=64):
+        """
+        Walk the item_list cursor chain of a prepared user
+        :param cursor_window: recent cursors remembered for loop detection, memory stays constant on deep crawls
+        :return: async iterator of (payload, last), `last` is True when the chain ends at that page
+        """
+        c = 0
+        seen_cursors = deque(maxlen=cursor_window)
+        while True:
             try:
-                await asyncio.sleep(sleep_after)
+                if sleep_after:
+                    await asyncio.sleep(sleep_after)
                 if cursor:
                     self.params["cursor"] = cursor
-                seen_cursors.add(cursor)
+                if not seen_cursors or seen_cursors[-1] != cursor:
+                    seen_cursors.append(cursor)
 
-                url = "https://www.tiktok.com/api/post/item_list/?" + urlencode(self.params)
-                response = await self.parent.make_inject_request(url=url)
+                response = await self.fetch_page(self.params, fast_path, ITEM_PROJECTION if project else None)
                 if not response:
-                    raise EmptyResponseError(f"{url} empty response body")
-                item_list = response.json().get("itemList")
-                for item in item_list:
-                    found += 1
-                    yield item
-                cursor = response.json().get("cursor")
-                if not cursor or cursor in seen_cursors:
-                    self.logger.error(f"{self} cursor[{cursor}] is null or duplicated")
-                    break
+                    raise EmptyResponseError(f"{self} cursor[{cursor}] empty response body")
+                payload = response.json()
+                if payload.get("itemList") is None:
+                    raise EmptyResponseError(f"{self} cursor[{cursor}] empty itemList")
                 c = 0
             except Exception as e:
                 c += 1
                 if c > retry:
                     self.logger.error(f"{self} exit {c}/{retry} exc: {e}")
-                    break
+                    return
 
                 self.logger.error(f"{self} {c}/{retry} exc: {e}")
-                if str(e).find("Timeout") > -1 or str(e).find("NS_ERROR_PROXY_AUTHENTICATION_FAILED") > -1:
+                if is_page_error(e):
                     self.parent.page_error = True
+                if not sleep_after:
+                    # the pacer of the failing session backs off, another session may be picked next
+                    await asyncio.sleep(c)
+                continue
 
+            cursor = payload.get("cursor")
+            last = not cursor or cursor in seen_cursors
+            if last:
+                self.logger.error(f"{self} cursor[{cursor}] is null or duplicated")
+            yield payload, last
+            if last:
+                return
 
-    async def videos_as_list(self, limit, cursor='0', retry=3, sleep_after=2):
+    @staticmethod
+    def _is_known(item, since, known_ids):
+        if str(item.get("id")) in known_ids:
+            return True
+        return since is not None and int(item.get("createTime") or 0) <= since
+
+    async def videos_as_rows(self, limit, cursor='0', retry=3, sleep_after=None, fast_path=False, checkpoint=None,
+                             since=None, known_ids=None, project=False, prefetch=0, deep=False,
+                             cursor_window=64, progress_every=10, on_commit=None):
+        """
+        Yield flat export rows as pages arrive, items missing a field are logged and skipped
+        :return:
+        """
+        extract = row_extractor()
+        async for item in self.videos(limit, cursor, retry, sleep_after, fast_path, checkpoint, since, known_ids,
+                                      project, prefetch=prefetch, deep=deep, cursor_window=cursor_window,
+                                      progress_every=progress_every, on_commit=on_commit):
+            try:
+                yield extract(item)
+            except Exception as e:
+                self.logger.error(str(e) + " data={}".format(json.dumps(item)))
+
+    async def videos_as_list(self, limit, cursor='0', retry=3, sleep_after=None, fast_path=False, checkpoint=None,
+                             since=None, known_ids=None, project=False, prefetch=0, deep=False,
+                             cursor_window=64, progress_every=10, on_commit=None):
         data = {
             "status": 1,
             "msg": "",
@@ -256,39 +610,12 @@ class TikTokUser:
                 "user_name": None
             }
         }
-        video_rule = {
-            "id": ("id",),
-            "picture_url": ("video", "cover"),
-            "video_url": ("video", "bitrateInfo", 0, "PlayAddr", "UrlList", -1),
-            "width": ("video", "bitrateInfo", 0, "PlayAddr", "Width"),
-            "height": ("video", "bitrateInfo", 0, "PlayAddr", "Height"),
-            "duration_second": ("video", "duration"),
-        }
-        item_rule = {
-            "user_id": ("author", "id"),
-            "username": ("author", "uniqueId"),
-            "item_id": ("id",),
-            "videos": None,
-            "publish_time": ("createTime",),
-            "description": ("desc",),
-            "like_count": ("stats", "diggCount"),
-            "download_count": ("stats", "collectCount"),
-            "comment_count": ("stats", "commentCount"),
-            "play_count": ("stats", "playCount"),
-            "share_count": ("stats", "shareCount")
-        }
-        user_rule = {
-            "user_id": ("author", "id"),
-            "username": ("author", "uniqueId"),
-            "nickname": ("author", "nickname"),
-            "avatar_url": ("author", "avatarLarger"),
-            "signature": ("author", "signature")
-        }
         i = 0
         _inner_data = data["data"]
-        async for item in self.videos(limit, cursor, retry, sleep_after):
-            item_info = dict()
-            author_info = dict()
+        extract = row_extractor()
+        async for item in self.videos(limit, cursor, retry, sleep_after, fast_path, checkpoint, since, known_ids,
+                                      project, prefetch=prefetch, deep=deep, cursor_window=cursor_window,
+                                      progress_every=progress_every, on_commit=on_commit):
             if i == 0:
                 _inner_data["cursor_info"]["user_id"] = traverse_obj(item, ("author", "id"))
                 _inner_data["cursor_info"]["sec_uid"] = traverse_obj(item, ("author", "secUid"))
@@ -299,38 +626,11 @@ class TikTokUser:
             i += 1
             try:
                 _inner_data["cursor_info"]["cursor"] = "%d" % (traverse_obj(item, ("createTime",), default=0) * 1000)
-                for e in item_rule:
-                    if not isinstance(item_rule[e], tuple):
-                        continue
-                    value = traverse_obj(item, item_rule[e])
-                    if value is None:
-                        raise ValueError(f"null value {e} {item_rule[e]}")
-                    item_info[e] = value
-
-                video_info = dict()
-                for e in video_rule:
-                    if not isinstance(video_rule[e], tuple):
-                        continue
-                    value = traverse_obj(item, video_rule[e])
-                    if value is None:
-                        raise ValueError(f"null value {e} {video_rule[e]}")
-                    video_info[e] = value
-
-                item_info.update(video_info)
-
-                for e in user_rule:
-                    if not isinstance(user_rule[e], tuple):
-                        continue
-                    value = traverse_obj(item, user_rule[e])
-                    if value is None:
-                        raise ValueError(f"null value {e} {user_rule[e]}")
-                    author_info[e] = value
-                item_info.update(author_info)
                 data["data"]["items"].append(
-                    item_info
+                    extract(item)
                 )
             except Exception as e:
-                self.logger.error(str(e) + " datanull=null".format(self, json.dumps(item)))
+                self.logger.error(str(e) + " data={}".format(json.dumps(item)))
 
         if len(data["data"]["items"]) == 0:
             data["status"] = 0
@@ -5,20 +5,26 @@
 # @File    : bdriver.py
 # @Software: PyCharm
 import asyncio
+import contextlib
 import dataclasses
-import datetime
+import functools
 import random
 import time
 from base64 import b64encode
+from http.cookies import Morsel
 from typing import Any
 from urllib.parse import urlparse
 
-import requests
-from playwright.async_api import async_playwright, Page
-from requests.cookies import RequestsCookieJar
+import aiohttp
+from playwright.async_api import async_playwright, Page, TimeoutError as PlaywrightTimeoutError
+from yarl import URL
 
 from workers.api.tiktok_user import TikTokUser
-from workers.stealth import stealth_async
+from workers.exceptions.inject_exception import SessionQueueFullError, RequestTimeoutError
+from workers.js.fetch_helper import fetch_helper, fetch_invoke
+from workers.pacer import AdaptivePacer
+from workers.response import InjectResponse
+from workers.stealth import stealth_script, isolate_script
 from loguru import logger
 
 
@@ -45,6 +51,37 @@ class TikTokPlaywrightSession:
     latest_at: int = 0
     create_at: int = 0
     expired_at: int = 0
+    in_flight: int = 0
+    retired: bool = False
+    http_client: Any = None
+    fingerprint: dict = None
+    pacer: AdaptivePacer = dataclasses.field(default_factory=AdaptivePacer)
+    # page.evaluate calls running on the page, a navigation waits for them to drain
+    evaluating: int = 0
+    navigating: bool = False
+    page_state: asyncio.Condition = dataclasses.field(default_factory=asyncio.Condition)
+
+
+def cookie_morsel(cookie):
+    """
+    Playwright cookie as a Morsel scoped like the browser does, `.tiktok.com` cookies stay domain cookies
+    and cookies without a leading dot stay host-only
+    :param cookie:
+    :return:
+    """
+    morsel = Morsel()
+    morsel.set(cookie["name"], cookie["value"], cookie["value"])
+    if cookie["domain"].startswith("."):
+        morsel["domain"] = cookie["domain"]
+    morsel["path"] = cookie.get("path") or "/"
+    if cookie.get("secure"):
+        morsel["secure"] = True
+    return morsel
+
+
+@functools.lru_cache(maxsize=1)
+def session_init_script():
+    return stealth_script() + "\n" + isolate_script(fetch_helper)
 
 
 async def block_aggressively(route):
@@ -56,7 +93,6 @@ async def block_aggressively(route):
 
 
 class TikTokSession:
-    user = TikTokUser
 
     def __init__(self):
         self._session_pool = []
@@ -64,9 +100,30 @@ class TikTokSession:
         self.playwright = None
         self.browser = None
         self._page_error = False
-
-        TikTokUser.parent = self
-        TikTokUser.logger = logger
+        self._max_in_flight = 1
+        self._max_queue = 0
+        self._slots = None
+        self._waiting = 0
+        self._session_options = None
+        self._session_ttl = 900
+        self._lifecycle_task = None
+        self._proxy_url = None
+        # optional ResolverCache consulted before any username lookup
+        self.resolver = None
+        # default deadline in seconds of a single request, enforced in the page and by asyncio
+        self.request_timeout = 15
+        # seconds spent per bootstrap phase, context phases are summed over the concurrent sessions
+        self.bootstrap_timings = {}
+
+    def user(self, username=None, sec_uid=None):
+        """
+        Create a TikTokUser bound to this session pool, every user gets its own logger context
+        :param username:
+        :param sec_uid:
+        :return:
+        """
+        return TikTokUser(username=username, sec_uid=sec_uid, parent=self,
+                          logger=logger.bind(user=username or sec_uid), resolver=self.resolver)
 
     async def create_session(
             self,
@@ -78,135 +135,394 @@ class TikTokSession:
             cookies: list = None,
             browser: str = "chromium",
             executable_path: str = None,
-            disable_image: bool = False
+            disable_image: bool = False,
+            num_sessions: int = 1,
+            max_in_flight: int = 1,
+            max_queue: int = 0
     ):
-        self.playwright = await async_playwright().start()
-        self._browser_type = browser
+        """
+        Launch the browser (once) and create `num_sessions` contexts on it concurrently
+        :param num_sessions: number of contexts/pages in the pool
+        :param max_in_flight: concurrent requests allowed on a single session page,
+            navigations of the page wait until they have drained
+        :param max_queue: requests allowed to wait for a free session, 0 means unbounded
+        :return:
+        """
         auth = None
         if proxy and isinstance(proxy, str):
+            self._proxy_url = proxy
             struct_url = urlparse(proxy)
             proxy = {"server": "{}://{}:{}".format(struct_url.scheme, struct_url.hostname, struct_url.port)}
             if struct_url.username and struct_url.password:
                 auth = struct_url.username + ":" + struct_url.password
         logger.info("proxy={} auth={}".format(proxy, auth))
-        if browser == "chromium":
-            if headless and override_browser_args is None:
-                override_browser_args = ["--headless=new"]
-                headless = False  # managed by the arg
-            self.browser = await self.playwright.chromium.launch(
-                headless=headless, args=override_browser_args,
-                executable_path=executable_path
-            )
-        elif browser == "firefox":
-            self.browser = await self.playwright.firefox.launch(
-                headless=headless, args=override_browser_args,
-                executable_path=executable_path,
-                ignore_default_args=["--mute-audio"],
-            )
 
-        else:
-            raise ValueError("Invalid browser argument passed")
-
-        context = await self.browser.new_context(proxy=proxy, **context_options)
-        if auth and self._browser_type == "firefox":
-            await context.set_extra_http_headers(
-                {"Proxy-Authorization": "Basic " + b64encode(auth.encode()).decode("utf8")})
-        if cookies is not None:
-            formatted_cookies = [
-                {"name": k, "value": v, "domain": urlparse(starting_url).netloc, "path": "/"}
-                for k, v in cookies.items()
-                if v is not None
-            ]
-            await context.add_cookies(formatted_cookies)
-        page = await context.new_page()
-        await stealth_async(page)
-
-        request_headers = None
-
-        def handle_request(request):
-            nonlocal request_headers
-            request_headers = request.headers
-            if request.url.find("post"):
-                print("Request", request.url)
+        st = time.time()
+        if self.browser is None:
+            await self._launch_browser(headless, browser, override_browser_args, executable_path)
+
+        self._max_in_flight = max(1, max_in_flight)
+        self._max_queue = max_queue
+        self._slots = asyncio.Semaphore(self._max_in_flight * (len(self._session_pool) + num_sessions))
+        self._session_options = dict(proxy=proxy, auth=auth, starting_url=starting_url,
+                                     context_options=context_options, cookies=cookies,
+                                     disable_image=disable_image)
+        with self._timed("sessions"):
+            await asyncio.gather(*(
+                self._create_context_session(**self._session_options)
+                for _ in range(num_sessions)
+            ))
+        self.bootstrap_timings["total"] = time.time() - st
+        logger.info("bootstrap {} sessions {}".format(
+            num_sessions, {k: round(v, 3) for k, v in self.bootstrap_timings.items()}))
+        return self.bootstrap_timings
+
+    @contextlib.contextmanager
+    def _timed(self, phase):
+        st = time.time()
+        try:
+            yield
+        finally:
+            self.bootstrap_timings[phase] = self.bootstrap_timings.get(phase, 0) + time.time() - st
 
-        if disable_image:
-            await page.route("**/*", block_aggressively)
+    async def _launch_browser(self, headless, browser, override_browser_args, executable_path):
+        if browser not in ("chromium", "firefox"):
+            raise ValueError("Invalid browser argument passed")
+        with self._timed("playwright"):
+            self.playwright = await async_playwright().start()
+        self._browser_type = browser
+        with self._timed("browser"):
+            if browser == "chromium":
+                if headless and override_browser_args is None:
+                    override_browser_args = ["--headless=new"]
+                    headless = False  # managed by the arg
+                self.browser = await self.playwright.chromium.launch(
+                    headless=headless, args=override_browser_args,
+                    executable_path=executable_path
+                )
+            else:
+                self.browser = await self.playwright.firefox.launch(
+                    headless=headless, args=override_browser_args,
+                    executable_path=executable_path,
+                    ignore_default_args=["--mute-audio"],
+                )
+
+    async def _create_context_session(self, proxy, auth, starting_url, context_options, cookies, disable_image):
+        with self._timed("new_context"):
+            context = await self.browser.new_context(proxy=proxy, **context_options)
+            if auth and self._browser_type == "firefox":
+                await context.set_extra_http_headers(
+                    {"Proxy-Authorization": "Basic " + b64encode(auth.encode()).decode("utf8")})
+            if cookies is not None:
+                formatted_cookies = [
+                    {"name": k, "value": v, "domain": urlparse(starting_url).netloc, "path": "/"}
+                    for k, v in cookies.items()
+                    if v is not None
+                ]
+                await context.add_cookies(formatted_cookies)
+        with self._timed("init_scripts"):
+            # stealth scripts and the fetch helper in a single round-trip, applied to every page of the context
+            await context.add_init_script(session_init_script())
+            if disable_image:
+                await context.route("**/*", block_aggressively)
+        with self._timed("new_page"):
+            page = await context.new_page()
 
-        page.once("request", handle_request)
         session = TikTokPlaywrightSession(
             context,
             page,
             proxy=proxy,
-            headers=request_headers,
             base_url=starting_url,
             latest_at=0,
             create_at=int(time.time()),
-            expired_at=int(time.time()) + 900
+            expired_at=int(time.time()) + self._session_ttl
         )
+
+        def handle_request(request):
+            session.headers = request.headers
+            if "post" in request.url:
+                logger.debug(f"Request {request.url}")
+
+        context.once("request", handle_request)
         self._session_pool.append(session)
+        return session
+
+    async def new_page(self, session):
+        """
+        Open another page in the session's context, init scripts and routing are already registered
+        on the context so the page is ready immediately. It is closed together with the context.
+        :param session:
+        :return:
+        """
+        return await session.context.new_page()
 
     def _get_session(self):
         if len(self._session_pool) == 0:
             raise ValueError("empty session")
 
-        i = random.randint(0, len(self._session_pool) - 1)
-        self._session_pool[i].latest_at = int(time.time())
-        return i, self._session_pool[i]
+        # retired sessions are draining, only fall back to them if nothing else is left
+        candidates = [e for e in enumerate(self._session_pool) if not e[1].retired]
+        if not candidates:
+            candidates = list(enumerate(self._session_pool))
+        # least loaded first, the least recently used one breaks ties
+        i, session = min(candidates, key=lambda e: (e[1].in_flight, e[1].latest_at))
+        session.latest_at = int(time.time())
+        return i, session
+
+    @contextlib.asynccontextmanager
+    async def acquire_session(self):
+        """
+        Reserve the least loaded session for one request, waiting in a bounded queue when every session is busy
+        :return:
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_in_flight * max(1, len(self._session_pool)))
+        if self._slots.locked():
+            if self._max_queue and self._waiting >= self._max_queue:
+                raise SessionQueueFullError(f"{self._waiting} requests already waiting for a session")
+            self._waiting += 1
+            try:
+                await self._slots.acquire()
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
 
-    async def make_inject_request(self, url=None):
-        st = time.time()
         i, session = self._get_session()
+        session.in_flight += 1
+        try:
+            yield session
+        finally:
+            session.in_flight -= 1
+            self._slots.release()
+
+    def start_lifecycle(self, ttl: int = 900, idle_timeout: int = 300, interval: int = 30):
+        """
+        Start the background task that recycles expired or idle sessions
+        :param ttl: seconds a session may live before it is replaced
+        :param idle_timeout: seconds without requests before a session is replaced
+        :param interval: seconds between two checks
+        :return:
+        """
+        self._session_ttl = ttl
+        for session in self._session_pool:
+            session.expired_at = session.create_at + ttl
+        if self._lifecycle_task is None or self._lifecycle_task.done():
+            self._lifecycle_task = asyncio.create_task(self._lifecycle_loop(idle_timeout, interval))
+        return self._lifecycle_task
+
+    async def _lifecycle_loop(self, idle_timeout, interval):
+        while True:
+            await asyncio.sleep(interval)
+            now = int(time.time())
+            stale = [
+                session for session in self._session_pool
+                if not session.retired and (
+                        now >= session.expired_at or now - max(session.latest_at, session.create_at) >= idle_timeout)
+            ]
+            for session in stale:
+                try:
+                    await self._recycle_session(session)
+                except Exception as e:
+                    logger.error(f"recycle session failed exc: {e}")
+
+    async def _recycle_session(self, session):
+        # warm the replacement first so the pool never shrinks while the old one drains
+        await self._create_context_session(**self._session_options)
+        session.retired = True
+        logger.info(f"retire session created at {session.create_at}, in flight {session.in_flight}")
+        while session.in_flight > 0:
+            await asyncio.sleep(0.5)
+        self._session_pool.remove(session)
+        await self._close_session(session)
+
+    async def _close_session(self, session):
+        try:
+            if session.http_client is not None:
+                await session.http_client.close()
+            await session.page.close()
+            await session.context.close()
+        except Exception as e:
+            logger.error(f"close session failed exc: {e}")
+
+    async def make_inject_request(self, url=None, session=None, projection=None, method="GET", headers=None,
+                                  body=None, timeout=None, challenged=None):
+        """
+        Run an XHR inside the session page through the installed fetch helper
+        :param url:
+        :param session: an already acquired session, otherwise the least loaded one is used
+        :param projection: optional list of item path tuples, the page then parses the JSON itself and
+            returns only `statusCode`, `cursor`, `hasMore` and those paths of every `itemList` entry
+        :param method:
+        :param headers:
+        :param body:
+        :param timeout: deadline in seconds, defaults to request_timeout
+        :param challenged: optional predicate telling the pacer a response is unusable,
+            by default only empty bodies and "Please wait..." pages slow the session down
+        :return:
+        """
+        timeout = timeout or self.request_timeout
+        args = {"url": url, "method": method, "headers": headers, "body": body,
+                "timeout": int(timeout * 1000), "projection": projection}
+        if session is not None:
+            return await self._make_inject_request(session, args, challenged)
+        async with self.acquire_session() as session:
+            return await self._make_inject_request(session, args, challenged)
+
+    async def _make_inject_request(self, session, args, challenged=None):
+        await session.pacer.acquire()
+        st = time.time()
+        try:
+            response = await self._send_inject_request(session, args)
+        except Exception:
+            session.pacer.record(time.time() - st, ok=False)
+            raise
+        if challenged is None:
+            ok = bool(response) and response.text.find("Please wait...") == -1
+        else:
+            ok = not challenged(response)
+        session.pacer.record(time.time() - st, ok=ok)
+        return response
+
+    async def _send_inject_request(self, session, args):
+        st = time.time()
+        timeout = args["timeout"] / 1000
         if session.page.url.find(session.base_url) == -1:
-            await session.page.goto(session.base_url)
-        method = 'GET'
-        js_tpl = f"""
-                  () => {{
-                      return new Promise((resolve, reject) => {{
-                            var xhr = new XMLHttpRequest();
-                            xhr.open('{method}', '{url}', true);
-                    
-                            xhr.onload = function() {{
-                                if (xhr.status >= 200 && xhr.status < 300) {{
-                                    resolve(xhr.responseText);
-                                }} else {{
-                                    reject(xhr.statusText);
-                                }}
-                            }};
-                    
-                            xhr.onerror = function() {{
-                                reject(xhr.statusText);
-                            }};
-                    
-                            xhr.send();
-                      }});
-                  }}
-              """
-        logger.info(f"{js_tpl}")
-        result = await self.execute_js_script(session, js_tpl)
-        if not result:
+            await self.goto(session, session.base_url, timeout)
+        logger.info(f"{args['method']} {args['url']}")
+        result = await self._evaluate_fetch(session, args, timeout)
+        if result and result.get("missing"):
+            await self.execute_js_script(session, fetch_helper)
+            result = await self._evaluate_fetch(session, args, timeout)
+        if result and "data" in result:
+            return self._build_response(session, args["url"], "", st, result["status"], data=result["data"])
+        if not result or not result["text"]:
             return ""
-        res = requests.Response()
-        cookie_jar = RequestsCookieJar()
-        response_dict = {"_content": result.encode(), "cookies": cookie_jar, "encoding": "utf-8",
-                         "headers": session.headers, "status_code": 200, "elapsed": (time.time() - st) * 1000,
-                         "url": url}
+        return self._build_response(session, args["url"], result["text"], st, result["status"])
+
+    async def _evaluate_fetch(self, session, args, timeout):
+        # the xhr aborts itself after `timeout`, asyncio gives it a small grace period before cancelling
+        try:
+            return await asyncio.wait_for(self.execute_js_script(session, fetch_invoke, args), timeout + 2)
+        except asyncio.TimeoutError:
+            raise RequestTimeoutError(f"{args['url']} no response in {timeout}s")
+        except Exception as e:
+            if "xhr timeout" in str(e):
+                raise RequestTimeoutError(f"{args['url']} xhr timeout after {timeout}s") from e
+            raise
+
+    async def goto(self, session, url, timeout=None):
+        """
+        Navigate the session page, timeouts are raised as RequestTimeoutError
+        :param session:
+        :param url:
+        :param timeout: seconds, defaults to request_timeout
+        :return:
+        """
+        timeout = timeout or self.request_timeout
+        async with self._page_navigation(session):
+            try:
+                return await session.page.goto(url, timeout=timeout * 1000)
+            except PlaywrightTimeoutError as e:
+                raise RequestTimeoutError(f"{url} navigation timeout after {timeout}s") from e
+
+    @contextlib.asynccontextmanager
+    async def _page_evaluation(self, session):
+        # shared access, several evaluations may run on the page unless it is navigating
+        async with session.page_state:
+            await session.page_state.wait_for(lambda: not session.navigating)
+            session.evaluating += 1
+        try:
+            yield
+        finally:
+            async with session.page_state:
+                session.evaluating -= 1
+                session.page_state.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def _page_navigation(self, session):
+        # exclusive access, a navigation destroys the execution context of every running evaluation
+        async with session.page_state:
+            await session.page_state.wait_for(lambda: not session.navigating)
+            session.navigating = True
+            await session.page_state.wait_for(lambda: session.evaluating == 0)
+        try:
+            yield
+        finally:
+            async with session.page_state:
+                session.navigating = False
+                session.page_state.notify_all()
+
+    async def _get_http_client(self, session):
+        if session.http_client is None:
+            headers = {k: v for k, v in (session.headers or {}).items()
+                       if k.lower() in ("user-agent", "accept-language")}
+            headers.update({"Accept": "application/json, text/plain, */*", "Referer": session.base_url + "/"})
+            session.http_client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._max_in_flight * 4, ttl_dns_cache=300),
+                headers=headers,
+                cookie_jar=aiohttp.CookieJar()
+            )
+            await self.sync_http_cookies(session)
+        return session.http_client
 
-        response_dict["elapsed"] = datetime.timedelta(
-            0, 0, response_dict["elapsed"]
-        )  # 耗时
-        response_dict["connection"] = None
-        response_dict["_content_consumed"] = True
+    async def sync_http_cookies(self, session):
+        """
+        Copy the browser context cookies into the session's aiohttp client
+        :param session:
+        :return:
+        """
+        if session.http_client is None:
+            return
+        for cookie in await session.context.cookies(session.base_url):
+            session.http_client.cookie_jar.update_cookies(
+                {cookie["name"]: cookie_morsel(cookie)},
+                response_url=URL("https://" + cookie["domain"].lstrip("."))
+            )
+
+    async def make_http_request(self, url=None, session=None, timeout=None):
+        """
+        Fetch a JSON api page directly with the context's cookies and headers, skipping page.evaluate
+        :param url:
+        :param session: an already acquired session, otherwise the least loaded one is used
+        :param timeout: deadline in seconds, defaults to request_timeout
+        :return:
+        """
+        if session is None:
+            async with self.acquire_session() as session:
+                return await self.make_http_request(url, session, timeout)
+        timeout = timeout or self.request_timeout
+        client = await self._get_http_client(session)
+        await session.pacer.acquire()
+        st = time.time()
+        try:
+            async with client.get(url, proxy=self._proxy_url,
+                                  timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                result = await response.text()
+        except asyncio.TimeoutError as e:
+            session.pacer.record(time.time() - st, ok=False)
+            raise RequestTimeoutError(f"{url} no response in {timeout}s") from e
+        except Exception:
+            session.pacer.record(time.time() - st, ok=False)
+            raise
+        # content level challenges fall back to the page, only transport failures slow the session down
+        session.pacer.record(time.time() - st, ok=response.status < 400)
+        if not result:
+            return ""
+        return self._build_response(session, url, result, st, response.status)
 
-        res.__dict__.update(response_dict)
-        return res
+    def _build_response(self, session, url, result, st, status_code=200, data=None):
+        return InjectResponse(url, result, status_code=status_code, elapsed=time.time() - st,
+                              headers=session.headers, data=data)
 
     get_session = _get_session
 
-    async def execute_js_script(self, session, js_code):
+    async def execute_js_script(self, session, js_code, arg=None):
         if session is None:
             i, session = self._get_session()
 
-        result = await session.page.evaluate(js_code)
+        async with self._page_evaluation(session):
+            result = await session.page.evaluate(js_code, arg)
         if not result:
             return ""
         return result
@@ -218,9 +534,14 @@ class TikTokSession:
 
         This is called automatically when using the TikTokApi with "with"
         """
+        if self._lifecycle_task is not None:
+            self._lifecycle_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._lifecycle_task
+            self._lifecycle_task = None
         for session in self._session_pool:
-            await session.page.close()
-            await session.context.close()
+            await self._close_session(session)
+        self._session_pool = []
 
         await self.stop_playwright()
 
@@ -231,8 +552,10 @@ class TikTokSession:
         """Stop the playwright browser"""
         if self.browser:
             await self.browser.close()
+            self.browser = None
         if self.playwright:
             await self.playwright.stop()
+            self.playwright = None
 
     async def __aexit__(self, exc_type, exc, tb):
         await self.close_sessions()
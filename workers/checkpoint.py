@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/16 11:37
+# @Author  : pikadoramon
+# @File    : checkpoint.py
+# @Software: PyCharm
+import sqlite3
+import time
+
+
+class CheckpointStore:
+    """
+    SQLite backed crawl progress: the next cursor of every user and the item ids already emitted.
+    A page is committed once its items were written out (see TikTokUser.videos `on_commit`),
+    so a crash replays at most one page and never skips rows that did not reach the output.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cursors (
+                user_key TEXT PRIMARY KEY,
+                cursor TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                user_key TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                PRIMARY KEY (user_key, item_id)
+            );
+        """)
+        self._conn.commit()
+
+    def get_cursor(self, user_key):
+        """
+        :param user_key:
+        :return: (cursor, done), cursor is None for unknown users
+        """
+        row = self._conn.execute("SELECT cursor, done FROM cursors WHERE user_key = ?", (user_key,)).fetchone()
+        if row is None:
+            return None, False
+        return row[0], bool(row[1])
+
+    def seen_items(self, user_key):
+        rows = self._conn.execute("SELECT item_id FROM items WHERE user_key = ?", (user_key,))
+        return {row[0] for row in rows}
+
+    def item_count(self, user_key):
+        return self._conn.execute("SELECT COUNT(*) FROM items WHERE user_key = ?", (user_key,)).fetchone()[0]
+
+    def known_items(self, user_key, item_ids):
+        """
+        Subset of `item_ids` already emitted, lets callers check one page at a time instead of loading every id
+        :param user_key:
+        :param item_ids:
+        :return:
+        """
+        item_ids = [str(e) for e in item_ids]
+        if not item_ids:
+            return set()
+        rows = self._conn.execute(
+            "SELECT item_id FROM items WHERE user_key = ? AND item_id IN ({})".format(",".join("?" * len(item_ids))),
+            [user_key] + item_ids
+        )
+        return {row[0] for row in rows}
+
+    def save_page(self, user_key, cursor, item_ids, done=False):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO cursors (user_key, cursor, done, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_key) DO UPDATE SET cursor = excluded.cursor, done = excluded.done, "
+                "updated_at = excluded.updated_at",
+                (user_key, cursor, int(done), int(time.time()))
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO items (user_key, item_id) VALUES (?, ?)",
+                ((user_key, str(item_id)) for item_id in item_ids)
+            )
+
+    def mark_done(self, user_key):
+        with self._conn:
+            self._conn.execute("UPDATE cursors SET done = 1, updated_at = ? WHERE user_key = ?",
+                               (int(time.time()), user_key))
+
+    def reset(self, user_key):
+        with self._conn:
+            self._conn.execute("DELETE FROM cursors WHERE user_key = ?", (user_key,))
+            self._conn.execute("DELETE FROM items WHERE user_key = ?", (user_key,))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
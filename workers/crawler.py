@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/12 10:21
+# @Author  : pikadoramon
+# @File    : crawler.py
+# @Software: PyCharm
+import asyncio
+import sys
+
+from loguru import logger
+
+from workers.api.tiktok_user import normalize_username
+
+
+def parse_target(line):
+    """
+    Turn one input line into TikTokUser arguments
+    accepts `name`, `@name`, `https://www.tiktok.com/@name` and sec_uid (MS4w...)
+    :param line:
+    :return: dict(username=..., sec_uid=...) or None for blank/comment lines
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("MS4w"):
+        return {"username": None, "sec_uid": line}
+    name = normalize_username(line)
+    if not name:
+        return None
+    return {"username": name, "sec_uid": None}
+
+
+def read_targets(path):
+    """
+    Iterate targets from a file, `-` reads stdin
+    :param path:
+    :return: an iterator for files, an async iterator for stdin
+    """
+    if path == "-":
+        return _read_stdin_targets()
+    return _read_file_targets(path)
+
+
+def _read_file_targets(path):
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            target = parse_target(line)
+            if target:
+                yield target
+
+
+async def _read_stdin_targets():
+    # a slow or interactive pipe must not block the event loop, lines are read in the default executor
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        target = parse_target(line)
+        if target:
+            yield target
+
+
+class TikTokCrawler:
+    """
+    Run one job per user on a shared TikTokSession.
+    `concurrency` bounds how many users are crawled at once, the per-session limit is the
+    pool's `max_in_flight`. A failing user never stops the others.
+    """
+
+    def __init__(self, api, concurrency: int = None):
+        self.api = api
+        self.concurrency = concurrency or max(1, len(api._session_pool) * api._max_in_flight)
+
+    async def crawl_user(self, target, job):
+        user = self.api.user(**target)
+        try:
+            return await job(user)
+        except Exception as e:
+            user.logger.error(f"{user} crawl failed exc: {e}")
+            return {
+                "status": -1,
+                "msg": str(e),
+                "data": None
+            }
+
+    async def run(self, targets, job):
+        """
+        Crawl every target and yield (target, result) as users finish
+        :param targets: iterable or async iterable of dict(username=..., sec_uid=...)
+        :param job: coroutine function receiving a TikTokUser, e.g. lambda u: u.videos_as_list(10)
+        :return:
+        """
+        pending = asyncio.Queue(maxsize=self.concurrency * 2)
+        done = asyncio.Queue()
+
+        async def producer():
+            try:
+                if hasattr(targets, "__aiter__"):
+                    async for target in targets:
+                        await pending.put(target)
+                else:
+                    for target in targets:
+                        await pending.put(target)
+            except Exception as e:
+                logger.error(f"read targets failed exc: {e}")
+            finally:
+                for _ in range(self.concurrency):
+                    await pending.put(None)
+
+        async def worker():
+            while True:
+                target = await pending.get()
+                if target is None:
+                    break
+                await done.put((target, await self.crawl_user(target, job)))
+            await done.put(None)
+
+        tasks = [asyncio.create_task(producer())]
+        tasks.extend(asyncio.create_task(worker()) for _ in range(self.concurrency))
+        running = self.concurrency
+        try:
+            while running:
+                result = await done.get()
+                if result is None:
+                    running -= 1
+                    continue
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"crawler finished concurrency={self.concurrency}")
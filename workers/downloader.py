@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/19 14:02
+# @Author  : pikadoramon
+# @File    : downloader.py
+# @Software: PyCharm
+import asyncio
+import hashlib
+import os
+
+import aiohttp
+from loguru import logger
+
+from workers.exceptions.download_exception import DownloadSizeError
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "Referer": "https://www.tiktok.com/",
+    # sizes are verified against Content-Length, which must describe the raw body
+    "Accept-Encoding": "identity",
+}
+
+
+def media_targets(row, output_dir):
+    """
+    (url, path, item_id, kind) tuples of an export row, one video and one cover per item
+    :param row:
+    :param output_dir:
+    :return:
+    """
+    folder = os.path.join(output_dir, str(row.get("username") or row.get("user_id") or "unknown"))
+    targets = []
+    if row.get("video_url"):
+        targets.append((row["video_url"], os.path.join(folder, f"{row['item_id']}.mp4"), row["item_id"], "video"))
+    if row.get("picture_url"):
+        targets.append((row["picture_url"], os.path.join(folder, f"{row['item_id']}.jpeg"), row["item_id"], "picture"))
+    return targets
+
+
+class MediaDownloader:
+    """
+    Bounded-concurrency media downloader over one pooled aiohttp session.
+    Files are streamed to `<path>.part` and resumed with a Range request, then renamed once
+    the size matches what the server announced. With a MediaStore the body is hashed while
+    streaming and stored content-addressed, items already in its manifest are not fetched again.
+
+        async with MediaDownloader("videos", concurrency=8) as downloader:
+            await downloader.submit(row)
+    """
+
+    def __init__(self, output_dir, concurrency=8, proxy=None, headers=None, retry=3,
+                 chunk_size=64 * 1024, timeout=60, store=None):
+        self.output_dir = output_dir
+        self.store = store
+        self.concurrency = concurrency
+        self.proxy = proxy
+        self.headers = headers or DEFAULT_HEADERS
+        self.retry = retry
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.stats = {"downloaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        if store is not None:
+            self.stats["dedup"] = 0
+        self._client = None
+        self._queue = None
+        self._workers = []
+
+    async def __aenter__(self):
+        self._client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300),
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=self.timeout)
+        )
+        self._queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        await self._client.close()
+        logger.info(f"downloader finished {self.stats}")
+
+    async def drain(self):
+        """Wait until every queued file is downloaded or has failed"""
+        await self._queue.join()
+
+    async def submit(self, row):
+        """Queue the media of an export row, waits while the queue is full"""
+        for target in media_targets(row, self.output_dir):
+            await self._queue.put(target)
+
+    async def _worker(self):
+        while True:
+            task = await self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                break
+            url, path, item_id, kind = task
+            try:
+                result = await self.download(url, path, item_id, kind)
+                if result["status"] != 1:
+                    logger.error(f"download {url} failed: {result['msg']}")
+            except Exception as e:
+                # a dead worker would leave submit() blocked on the bounded queue
+                self.stats["failed"] += 1
+                logger.error(f"download {url} failed exc: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def download(self, url, path, item_id=None, kind=None):
+        """
+        Download one file with resume and size verification
+        :param url:
+        :param path:
+        :param item_id: manifest key when a store is used
+        :param kind: video or picture
+        :return:
+        """
+        if os.path.exists(path):
+            self.stats["skipped"] += 1
+            return {"status": 1, "msg": "exists", "data": {"path": path, "size": os.path.getsize(path)}}
+        if self.store is not None and item_id is not None:
+            obj = self.store.lookup(item_id, kind)
+            if obj:
+                self.store.link(obj, path)
+                self.stats["skipped"] += 1
+                return {"status": 1, "msg": "stored", "data": {"path": path, "size": os.path.getsize(obj)}}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        msg = ""
+        for c in range(1, self.retry + 1):
+            try:
+                size = await self._download_once(url, path, item_id, kind)
+                self.stats["downloaded"] += 1
+                return {"status": 1, "msg": "", "data": {"path": path, "size": size}}
+            except Exception as e:
+                msg = str(e)
+                logger.warning(f"download {url} {c}/{self.retry} exc: {e}")
+                await asyncio.sleep(c)
+        self.stats["failed"] += 1
+        return {"status": -1, "msg": msg, "data": None}
+
+    async def _download_once(self, url, path, item_id=None, kind=None):
+        part = path + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        digest = hashlib.sha256() if self.store is not None else None
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        async with self._client.get(url, headers=headers, proxy=self.proxy) as response:
+            if response.status == 416:
+                # the part file already holds the whole body
+                total = offset
+            elif response.status == 206:
+                total = response.headers.get("Content-Range", "/*").rsplit("/", 1)[-1]
+                total = int(total) if total.isdigit() else 0
+            elif response.status == 200:
+                offset = 0
+                total = int(response.headers.get("Content-Length") or 0)
+            else:
+                raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                  status=response.status, message=response.reason)
+
+            if digest is not None and offset:
+                # resumed body, hash the bytes already on disk first
+                with open(part, "rb") as fp:
+                    for chunk in iter(lambda: fp.read(self.chunk_size), b""):
+                        digest.update(chunk)
+            if response.status != 416:
+                with open(part, "ab" if offset else "wb") as fp:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        fp.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        self.stats["bytes"] += len(chunk)
+
+        size = os.path.getsize(part)
+        if total and size != total:
+            if size > total:
+                os.remove(part)
+            raise DownloadSizeError(f"{path} expect {total} bytes got {size}")
+        if digest is not None:
+            known = self.store.lookup_digest(digest.hexdigest())
+            self.store.put(part, digest.hexdigest(), size, item_id if item_id is not None else path, kind, url, path)
+            if known:
+                self.stats["dedup"] += 1
+        else:
+            os.replace(part, path)
+        return size
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/19 14:08
+# @Author  : pikadoramon
+# @File    : download_exception.py
+# @Software: PyCharm
+
+
+class DownloadSizeError(ValueError):
+    pass
@@ -11,3 +11,9 @@ class EmptyResponseError(ValueError):
 
 class EmptyFieldError(ValueError):
     pass
+
+class SessionQueueFullError(RuntimeError):
+    pass
+
+class RequestTimeoutError(TimeoutError):
+    pass
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/14 16:02
+# @Author  : pikadoramon
+# @File    : export.py
+# @Software: PyCharm
+import csv
+import json
+import os
+
+
+class BaseSink:
+    """
+    Incremental row writer. Rows are flushed to disk every `flush_every` rows so a crash
+    only loses the rows written since the last flush.
+    """
+
+    def __init__(self, path, flush_every=35):
+        self.path = path
+        self.flush_every = flush_every
+        self.rows = 0
+        self._pending = 0
+
+    def write(self, row):
+        self._write(row)
+        self.rows += 1
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+
+    def _write(self, row):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _FileSink(BaseSink):
+
+    def __init__(self, path, flush_every=35, append=False):
+        super().__init__(path, flush_every)
+        self._fp = open(path, "a" if append else "w", encoding="utf-8", newline="")
+
+    def flush(self):
+        super().flush()
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+    def close(self):
+        if self._fp.closed:
+            return
+        self.flush()
+        self._fp.close()
+
+
+class CsvSink(_FileSink):
+    """The header is taken from the first row, later unknown keys are ignored"""
+
+    def __init__(self, path, flush_every=35, append=False):
+        super().__init__(path, flush_every, append)
+        self._writer = None
+
+    def _write(self, row):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._fp, fieldnames=list(row), extrasaction="ignore")
+            if self._fp.tell() == 0:
+                self._writer.writeheader()
+        self._writer.writerow(row)
+
+
+class JsonlSink(_FileSink):
+
+    def _write(self, row):
+        self._fp.write(json.dumps(row, ensure_ascii=False))
+        self._fp.write("\n")
+
+
+class ParquetSink(BaseSink):
+    """
+    Buffers `flush_every` rows and writes them as one row group.
+    The footer is only written on close, so use it as a context manager.
+    """
+
+    def __init__(self, path, flush_every=1000, append=False):
+        if append:
+            raise ValueError("parquet files can not be appended, use csv or jsonl to resume")
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("parquet export requires pyarrow, pip install pyarrow")
+        super().__init__(path, flush_every)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._buffer = []
+        self._writer = None
+
+    def _write(self, row):
+        self._buffer.append(row)
+
+    def flush(self):
+        super().flush()
+        if not self._buffer:
+            return
+        if self._writer is None:
+            table = self._pa.Table.from_pylist(self._buffer)
+            self._writer = self._pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = self._pa.Table.from_pylist(self._buffer, schema=self._writer.schema)
+        self._writer.write_table(table)
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+SINKS = {
+    "csv": CsvSink,
+    "jsonl": JsonlSink,
+    "parquet": ParquetSink,
+}
+
+
+def open_sink(path, fmt=None, **kwargs):
+    """
+    Open a sink by format name, guessed from the file extension when omitted
+    :param path:
+    :param fmt: csv, jsonl or parquet
+    :return:
+    """
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip(".").lower() or "csv"
+    if fmt not in SINKS:
+        raise ValueError(f"unsupported export format {fmt}")
+    return SINKS[fmt](path, **kwargs)
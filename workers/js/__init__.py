@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/9/5 10:02
+# @Author  : pikadoramon
+# @File    : __init__.py
+# @Software: PyCharm
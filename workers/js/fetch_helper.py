@@ -0,0 +1,50 @@
+# installed once per page as an init script, requests then only pass their arguments to page.evaluate
+fetch_helper = """
+(() => {
+    // keeps only the projected item paths, arrays keep their length so negative indices still resolve the same
+    const pick = (src, dst, path, i) => {
+        let key = path[i];
+        if (Array.isArray(src) && typeof key === 'number' && key < 0) key = src.length + key;
+        if (src === null || typeof src !== 'object' || !(key in src)) return;
+        const value = src[key];
+        if (i === path.length - 1 || value === null || typeof value !== 'object') {
+            dst[key] = value;
+            return;
+        }
+        if (dst[key] === undefined || dst[key] === null) dst[key] = Array.isArray(value) ? new Array(value.length).fill(null) : {};
+        pick(value, dst[key], path, i + 1);
+    };
+    const project = (payload, paths) => ({
+        statusCode: payload.statusCode,
+        cursor: payload.cursor,
+        hasMore: payload.hasMore,
+        itemList: (payload.itemList || []).map(item => {
+            const out = {};
+            paths.forEach(path => pick(item, out, path, 0));
+            return out;
+        })
+    });
+    const smtFetch = (args) => new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.open(args.method || 'GET', args.url, true);
+        Object.entries(args.headers || {}).forEach(([k, v]) => xhr.setRequestHeader(k, v));
+        if (args.timeout) xhr.timeout = args.timeout;
+        xhr.onload = () => {
+            if (args.projection && xhr.status >= 200 && xhr.status < 300) {
+                try {
+                    resolve({status: xhr.status, data: project(JSON.parse(xhr.responseText), args.projection)});
+                    return;
+                } catch (e) {}
+            }
+            resolve({status: xhr.status, text: xhr.responseText});
+        };
+        xhr.onerror = () => reject(new Error('xhr error ' + xhr.statusText));
+        xhr.ontimeout = () => reject(new Error('xhr timeout'));
+        xhr.send(args.body === undefined || args.body === null ? null : args.body);
+    });
+    Object.defineProperty(window, '__smtFetch', {value: smtFetch, enumerable: false, configurable: true});
+})();
+"""
+
+# evaluated per request, reports a missing helper (document created before installation) instead of failing
+fetch_invoke = "(args) => window.__smtFetch ? window.__smtFetch(args) : {missing: true}"
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/21 10:45
+# @Author  : pikadoramon
+# @File    : media_store.py
+# @Software: PyCharm
+import os
+import sqlite3
+import time
+
+from loguru import logger
+
+
+class MediaStore:
+    """
+    Content-addressed media storage. Every body is stored once under objects/<sha256[:2]>/<sha256><ext>,
+    user facing paths are hardlinks (symlinks across devices) to the object, and manifest.db maps
+    (item_id, kind) to the digest so known items are never downloaded twice.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "manifest.db"))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS assets (
+                item_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                url TEXT,
+                digest TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (item_id, kind)
+            );
+        """)
+        self._conn.commit()
+
+    def object_path(self, digest, ext=""):
+        return os.path.join(self.root, "objects", digest[:2], digest + ext)
+
+    def lookup(self, item_id, kind):
+        """
+        :param item_id:
+        :param kind: video or picture
+        :return: object path of a stored asset or None
+        """
+        row = self._conn.execute(
+            "SELECT o.path FROM assets a JOIN objects o ON a.digest = o.digest WHERE a.item_id = ? AND a.kind = ?",
+            (str(item_id), kind)
+        ).fetchone()
+        if row is None or not os.path.exists(row[0]):
+            return None
+        return row[0]
+
+    def lookup_digest(self, digest):
+        row = self._conn.execute("SELECT path FROM objects WHERE digest = ?", (digest,)).fetchone()
+        if row is None or not os.path.exists(row[0]):
+            return None
+        return row[0]
+
+    def put(self, src, digest, size, item_id, kind, url=None, link_path=None):
+        """
+        Move a verified download into the store, dropping it if the same bytes are already stored
+        :param src: finished temporary file, it is consumed
+        :param digest: sha256 hex digest of src
+        :param link_path: optional user facing path linked to the object
+        :return: object path
+        """
+        obj = self.lookup_digest(digest)
+        if obj is not None:
+            os.remove(src)
+            logger.info(f"dedup {item_id} {kind} -> {digest}")
+        else:
+            obj = self.object_path(digest, os.path.splitext(link_path or src.replace(".part", ""))[1])
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            os.replace(src, obj)
+        now = int(time.time())
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO objects (digest, size, path, created_at) VALUES (?, ?, ?, ?)",
+                               (digest, size, obj, now))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO assets (item_id, kind, url, digest, created_at) VALUES (?, ?, ?, ?, ?)",
+                (str(item_id), kind, url, digest, now)
+            )
+        if link_path:
+            self.link(obj, link_path)
+        return obj
+
+    @staticmethod
+    def link(obj, link_path):
+        if os.path.exists(link_path):
+            return
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+        try:
+            os.link(obj, link_path)
+        except OSError:
+            os.symlink(os.path.abspath(obj), link_path)
+
+    def close(self):
+        self._conn.close()
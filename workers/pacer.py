@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/9/10 14:31
+# @Author  : pikadoramon
+# @File    : pacer.py
+# @Software: PyCharm
+import asyncio
+import time
+
+
+class AdaptivePacer:
+    """
+    Token bucket whose rate adapts to how the server answers.
+    Healthy fast responses raise the rate additively, slow responses lower it a little,
+    errors and challenges halve it and pause the bucket with an exponential backoff.
+    """
+
+    def __init__(self, rate=1.0, min_rate=0.05, max_rate=4.0, burst=2, step=0.1,
+                 slow_latency=3.0, backoff=2.0, max_backoff=120.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.step = step
+        self.slow_latency = slow_latency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency = None
+        self.failures = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def record(self, latency, ok=True):
+        """
+        Feed back the outcome of one request
+        :param latency: seconds
+        :param ok: False for errors, empty bodies and "Please wait..." challenges
+        :return:
+        """
+        if not ok:
+            self.failures += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            self._blocked_until = time.monotonic() + min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+            return
+        self.failures = 0
+        self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+        if self.latency > self.slow_latency:
+            self.rate = max(self.min_rate, self.rate * 0.9)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def __repr__(self):
+        return f"<AdaptivePacer rate={self.rate:.2f}/s latency={self.latency} failures={self.failures}>"
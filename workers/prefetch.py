@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/9/12 15:40
+# @Author  : pikadoramon
+# @File    : prefetch.py
+# @Software: PyCharm
+import asyncio
+import contextlib
+
+_END = object()
+
+
+async def read_ahead(source, depth=1):
+    """
+    Consume an async iterator in a background task, keeping up to `depth` results ready.
+    The producer blocks once the buffer is full, errors are re-raised to the consumer and
+    closing the consumer cancels the producer.
+    :param source: async generator
+    :param depth: buffered results
+    :return:
+    """
+    queue = asyncio.Queue(maxsize=max(1, depth))
+
+    async def produce():
+        try:
+            async for value in source:
+                await queue.put((value, None))
+        except Exception as e:
+            await queue.put((_END, e))
+            return
+        await queue.put((_END, None))
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            value, error = await queue.get()
+            if value is _END:
+                if error is not None:
+                    raise error
+                return
+            yield value
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        await source.aclose()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/8/28 17:12
+# @Author  : pikadoramon
+# @File    : resolver_cache.py
+# @Software: PyCharm
+import sqlite3
+import time
+
+from workers.api.tiktok_user import normalize_username
+
+
+class ResolverCache:
+    """
+    Persistent username -> secUid/user_id map backed by SQLite.
+    Entries expire after `ttl` seconds, the least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=100000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                sec_uid TEXT NOT NULL,
+                user_id TEXT,
+                updated_at INTEGER NOT NULL,
+                accessed_at INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS users_accessed_at ON users (accessed_at);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(username):
+        return normalize_username(username).lower()
+
+    def get(self, username):
+        """
+        :param username:
+        :return: dict(sec_uid=..., user_id=...) or None when unknown or expired
+        """
+        key = self._key(username)
+        row = self._conn.execute("SELECT sec_uid, user_id, updated_at FROM users WHERE username = ?",
+                                 (key,)).fetchone()
+        if row is None:
+            return None
+        now = int(time.time())
+        with self._conn:
+            if now - row[2] >= self.ttl:
+                self._conn.execute("DELETE FROM users WHERE username = ?", (key,))
+                return None
+            self._conn.execute("UPDATE users SET accessed_at = ? WHERE username = ?", (now, key))
+        return {"sec_uid": row[0], "user_id": row[1]}
+
+    def put(self, username, sec_uid, user_id=None):
+        now = int(time.time())
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO users (username, sec_uid, user_id, updated_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self._key(username), sec_uid, user_id, now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM users WHERE username IN "
+                "(SELECT username FROM users ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Time    : 2024/9/2 11:18
+# @Author  : pikadoramon
+# @File    : response.py
+# @Software: PyCharm
+import datetime
+import json
+
+_UNPARSED = object()
+
+
+class InjectResponse:
+    """Minimal response of an in-page or direct http request, the JSON body is parsed once on first access"""
+
+    __slots__ = ("url", "text", "status_code", "elapsed", "headers", "_json")
+
+    def __init__(self, url, text, status_code=200, elapsed=0.0, headers=None, data=None):
+        self.url = url
+        self.text = text
+        self.status_code = status_code
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+        self.headers = headers or {}
+        # already parsed body, e.g. projected in the page
+        self._json = _UNPARSED if data is None else data
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    def json(self):
+        if self._json is _UNPARSED:
+            self._json = json.loads(self.text)
+        return self._json
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return f"<InjectResponse [{self.status_code}] {self.url}>"
@@ -1 +1 @@
-from .stealth import stealth_async
+from .stealth import stealth_async, stealth_context_async, stealth_script, isolate_script, StealthConfig
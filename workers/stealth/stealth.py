@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import json
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Tuple, Optional, Dict
 
-from playwright.async_api import Page as AsyncPage
+from playwright.async_api import Page as AsyncPage, BrowserContext as AsyncBrowserContext
 
 from .js.chrome_app import chrome_app
 from .js.chrome_csi import chrome_csi
@@ -47,7 +48,7 @@ SCRIPTS: Dict[str, str] = {
 }
 
 
-@dataclass
+@dataclass(unsafe_hash=True)
 class StealthConfig:
     """
     Playwright stealth configuration that applies stealth strategies to playwright page objects.
@@ -94,6 +95,11 @@ class StealthConfig:
     languages: Tuple[str] = ("en-US", "en")
     runOnInsecureOrigins: Optional[bool] = None
 
+    @property
+    def bundle(self) -> str:
+        """all enabled scripts joined into one init script, memoized per config"""
+        return _bundle(self)
+
     @property
     def enabled_scripts(self):
         opts = json.dumps(
@@ -147,7 +153,26 @@ class StealthConfig:
             yield SCRIPTS["webgl_vendor"]
 
 
+def isolate_script(script: str) -> str:
+    """wrap a script in its own block, a throwing script then does not stop the ones joined after it"""
+    return "try {\n" + script + "\n} catch (e) {}"
+
+
+@lru_cache(maxsize=16)
+def _bundle(config: StealthConfig) -> str:
+    return "\n".join(isolate_script(script) for script in config.enabled_scripts)
+
+
+def stealth_script(config: StealthConfig = None) -> str:
+    """all enabled scripts joined into one init script"""
+    return (config or StealthConfig()).bundle
+
+
 async def stealth_async(page: AsyncPage, config: StealthConfig = None):
     """stealth the page"""
-    for script in (config or StealthConfig()).enabled_scripts:
-        await page.add_init_script(script)
+    await page.add_init_script(stealth_script(config))
+
+
+async def stealth_context_async(context: AsyncBrowserContext, config: StealthConfig = None):
+    """stealth every page of the context, including the ones opened later"""
+    await context.add_init_script(stealth_script(config))